@@ -8,11 +8,293 @@
 # This is the outermost layer of the part of the program that you'll need to build,
 # which means that YOU WILL DEFINITELY NEED TO MAKE CHANGES TO THIS FILE.
 
+import asyncio
+import collections
+import re
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from functools import cache
 from pathlib import Path
 from p2app.events import *
 
 
+
+# The number of compiled statements sqlite3 keeps per connection.  Every search
+# form and every load/save statement fits comfortably, so none are re-prepared.
+_CACHED_STATEMENTS = 256
+
+# Pragmas applied to every connection as it's opened.  WAL with synchronous=NORMAL
+# turns each commit into an append to the write-ahead log instead of an fsync of a
+# separate rollback journal, which dominates the cost of interactive saves.  The
+# journal mode can't change inside a transaction, so these run on their own.
+_WAL_PRAGMA = """
+    PRAGMA journal_mode = WAL;
+"""
+_CONNECTION_PRAGMAS = """
+    PRAGMA synchronous = NORMAL;
+    PRAGMA temp_store = MEMORY;
+    PRAGMA cache_size = -20000;
+    PRAGMA foreign_keys = ON;
+"""
+
+# Indexes on the columns that searches and foreign keys filter by, created when a
+# connection is first opened.  The code columns are UNIQUE in the schema, so they
+# already have indexes of their own.  LIKE is case-insensitive, so only a NOCASE
+# index on names can serve prefix searches.
+_SEARCH_INDEXES = """
+    CREATE INDEX IF NOT EXISTS idx_country_continent ON country (continent_id);
+    CREATE INDEX IF NOT EXISTS idx_region_local_code ON region (local_code);
+    CREATE INDEX IF NOT EXISTS idx_region_country ON region (country_id);
+    CREATE INDEX IF NOT EXISTS idx_region_name ON region (name COLLATE NOCASE);
+"""
+
+# A trigram FTS5 index mirroring region names.  Trigram indexes can answer LIKE
+# patterns directly, so substring searches by name use the index instead of
+# comparing every region's name.  Triggers keep it in sync with the region table;
+# if they're missing, the index can't be trusted and is refilled from scratch.
+_REGION_FTS_TRIGGER = "region_fts_insert"
+_REGION_FTS_SETUP = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS region_fts USING fts5(
+        name, content = 'region', content_rowid = 'region_id', tokenize = 'trigram');
+
+    CREATE TRIGGER IF NOT EXISTS region_fts_insert AFTER INSERT ON region BEGIN
+        INSERT INTO region_fts (rowid, name) VALUES (new.region_id, new.name);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS region_fts_delete AFTER DELETE ON region BEGIN
+        INSERT INTO region_fts (region_fts, rowid, name) VALUES ('delete', old.region_id, old.name);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS region_fts_update AFTER UPDATE OF name ON region BEGIN
+        INSERT INTO region_fts (region_fts, rowid, name) VALUES ('delete', old.region_id, old.name);
+        INSERT INTO region_fts (rowid, name) VALUES (new.region_id, new.name);
+    END;
+"""
+_REGION_FTS_REBUILD = """
+    INSERT INTO region_fts (region_fts) VALUES ('rebuild');
+"""
+
+# Removes the triggers when the full-text index can't be used, since they would
+# otherwise make every write to region fail.
+_REGION_FTS_DROP_TRIGGERS = """
+    DROP TRIGGER IF EXISTS region_fts_insert;
+    DROP TRIGGER IF EXISTS region_fts_delete;
+    DROP TRIGGER IF EXISTS region_fts_update;
+"""
+
+# The shortest run of characters the trigram index can look up.  Name searches
+# with no run this long go to the plain LIKE query instead.
+_FTS_MIN_TERM_LENGTH = 3
+
+# The path sqlite3 treats as a private in-memory database rather than a file.
+_IN_MEMORY_PATH = ":memory:"
+
+# The number of idle connections kept open after their databases are closed.
+_POOL_CAPACITY = 4
+
+# Returned by the engine's I/O thread when an event has produced all its results.
+_NO_MORE_EVENTS = object()
+
+
+
+def _predicate_matrix(table, columns, predicates):
+    """Precomputes the SELECT for every combination of the given predicates,
+    keyed by a bitmask in which the first predicate is the most significant bit.
+    Searches then pick their SQL with one lookup instead of building it per call"""
+    queries = {}
+    count = len(predicates)
+
+    for mask in range(1 << count):
+        chosen = [predicates[i] for i in range(count) if mask & (1 << (count - 1 - i))]
+        query = f"SELECT {columns} FROM {table}"
+
+        if chosen:
+            query += " WHERE " + " AND ".join(chosen)
+
+        queries[mask] = query
+
+    return queries
+
+
+
+# Every query names its columns in the order of the corresponding model's fields,
+# so SQLite only copies out what the models need, regardless of how the tables'
+# columns are ordered.
+_CONTINENT_COLUMNS = "continent_id, continent_code, name"
+_COUNTRY_COLUMNS = "country_id, country_code, name, continent_id, wikipedia_link, keywords"
+_REGION_COLUMNS = (
+    "region_id, region_code, local_code, name, continent_id, country_id, wikipedia_link, keywords"
+)
+
+# Loads look up one row by primary key, so LIMIT 1 lets SQLite stop as soon as
+# it has found it.
+_LOAD_CONTINENT_SQL = f"SELECT {_CONTINENT_COLUMNS} FROM continent WHERE continent_id = ? LIMIT 1"
+_LOAD_COUNTRY_SQL = f"SELECT {_COUNTRY_COLUMNS} FROM country WHERE country_id = ? LIMIT 1"
+_LOAD_REGION_SQL = f"SELECT {_REGION_COLUMNS} FROM region WHERE region_id = ? LIMIT 1"
+
+_CONTINENT_QUERIES = _predicate_matrix("continent", _CONTINENT_COLUMNS, ("continent_code = ?", "name LIKE ?"))
+_COUNTRY_QUERIES = _predicate_matrix("country", _COUNTRY_COLUMNS, ("country_code = ?", "name LIKE ?"))
+_REGION_QUERIES = _predicate_matrix("region", _REGION_COLUMNS, ("region_code = ?", "local_code = ?", "name LIKE ?"))
+_REGION_NAME_FTS_QUERY = (
+    f"SELECT {_REGION_COLUMNS} FROM region WHERE region_id IN "
+    "(SELECT rowid FROM region_fts WHERE name LIKE ?)"
+)
+
+
+
+def _continent_from_row(row):
+    """Builds a Continent from a sqlite3.Row, reading its columns by name"""
+    return Continent(
+        continent_id = row["continent_id"],
+        continent_code = row["continent_code"],
+        name = row["name"])
+
+
+
+def _country_from_row(row):
+    """Builds a Country from a sqlite3.Row, reading its columns by name"""
+    return Country(
+        country_id = row["country_id"],
+        country_code = row["country_code"],
+        name = row["name"],
+        continent_id = row["continent_id"],
+        wikipedia_link = row["wikipedia_link"],
+        keywords = row["keywords"])
+
+
+
+def _region_from_row(row):
+    """Builds a Region from a sqlite3.Row, reading its columns by name"""
+    return Region(
+        region_id = row["region_id"],
+        region_code = row["region_code"],
+        local_code = row["local_code"],
+        name = row["name"],
+        continent_id = row["continent_id"],
+        country_id = row["country_id"],
+        wikipedia_link = row["wikipedia_link"],
+        keywords = row["keywords"])
+
+
+
+def _search_results(cursor, from_row, event_type):
+    """Turns each row of an executed search into a result event, building its
+    model with the same from_row function that loads use"""
+    return map(event_type, map(from_row, cursor))
+
+
+
+@cache
+def _is_fts_available():
+    """Determines whether the SQLite library was built with FTS5 and its trigram
+    tokenizer, which is true of the versions bundled with current Pythons.  It's
+    determined once, the first time a connection is configured"""
+    try:
+        with closing(sqlite3.connect(_IN_MEMORY_PATH)) as connection:
+            connection.execute("CREATE VIRTUAL TABLE probe USING fts5(name, tokenize = 'trigram')")
+
+        return True
+    except sqlite3.Error:
+        return False
+
+
+
+def _is_fts_searchable(name):
+    """Determines whether a name search can be answered by the trigram index,
+    which only matches what the plain LIKE query matches when the term has at
+    least three characters in a row that aren't wildcards.  Shorter terms, such
+    as "Zü", can find nothing in it"""
+    return any(len(run) >= _FTS_MIN_TERM_LENGTH for run in re.split("[%_]", name))
+
+
+
+_INSERT_REGION_SQL = (
+    "INSERT INTO region (region_code, local_code, name, continent_id, country_id, wikipedia_link, keywords) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+# Saves that report the stored row back to the user interface get it from a
+# RETURNING clause, rather than reloading it with a second query.
+_INSERT_CONTINENT_RETURNING_SQL = (
+    f"INSERT INTO continent (continent_code, name) VALUES (?, ?) RETURNING {_CONTINENT_COLUMNS}"
+)
+_INSERT_COUNTRY_RETURNING_SQL = (
+    "INSERT INTO country (country_code, name, continent_id, wikipedia_link, keywords) "
+    f"VALUES (?, ?, ?, ?, ?) RETURNING {_COUNTRY_COLUMNS}"
+)
+_INSERT_REGION_RETURNING_SQL = f"{_INSERT_REGION_SQL} RETURNING {_REGION_COLUMNS}"
+
+
+
+def _changed_fields(previous, current):
+    """Returns the names of the fields, other than the ID in the first field, whose
+    values differ between the last loaded version of a model and the one being
+    saved, or all of them if it was never loaded.  The fields are named after their
+    columns, so these are also the columns an UPDATE needs to write"""
+    fields = current._fields[1:]
+
+    if previous is None:
+        return fields
+
+    return tuple(field for field in fields if getattr(previous, field) != getattr(current, field))
+
+
+
+@cache
+def _update_sql(table, id_column, columns, returning = None):
+    """Builds the UPDATE that writes only the given columns of one row.  The result
+    is memoized, so each combination of columns reuses one cached statement"""
+    query = f"UPDATE {table} SET {', '.join(f'{column} = ?' for column in columns)} WHERE {id_column} = ?"
+
+    if returning:
+        query += f" RETURNING {returning}"
+
+    return query
+
+
+
+class _ConnectionPool:
+    """A small LRU pool of idle connections keyed by database path, so reopening a
+    recently closed database skips connecting to and configuring it again.  Each
+    connection is pooled along with whether its database has a usable full-text
+    index, since that was determined when it was configured"""
+
+    def __init__(self, capacity = _POOL_CAPACITY):
+        self._capacity = capacity
+        self._idle = collections.OrderedDict()
+
+    def acquire(self, path):
+        """Removes and returns the idle connection to the given path and its
+        full-text flag as a tuple, or None if there isn't one"""
+        return self._idle.pop(str(path), None)
+
+    def release(self, path, connection, has_fts):
+        """Returns a connection to the pool as its most recently used entry,
+        closing the least recently used one if the pool is over capacity"""
+        # An in-memory database would be resurrected by reopening it, so it's
+        # closed instead of pooled
+        if str(path) == _IN_MEMORY_PATH:
+            connection.close()
+            return
+
+        if connection.in_transaction:
+            connection.rollback()
+
+        self._idle[str(path)] = (connection, has_fts)
+
+        while len(self._idle) > self._capacity:
+            _, (oldest, _) = self._idle.popitem(last = False)
+            oldest.close()
+
+    def close_all(self):
+        """Closes every idle connection in the pool"""
+        while self._idle:
+            _, (connection, _) = self._idle.popitem()
+            connection.close()
+
+
+
 class Engine:
     """An object that represents the application's engine, whose main role is to
     process events sent to it by the user interface, then generate events that are
@@ -23,98 +305,285 @@ class Engine:
     def __init__(self):
         """Initializes the engine"""
         self.connection = None
-        pass
+        self.db_path = None
+        self._pool = _ConnectionPool()
+
+        # Whether the open database's full-text index on region names is usable
+        self._has_fts = False
+
+        # Whether a BeginBulkEvent has opened a transaction that saves should join
+        # rather than commit, until the matching EndBulkEvent
+        self._in_bulk = False
+
+        # The last version of each continent, country and region loaded from or saved
+        # to the open database, keyed by ID, so saves can write only what changed
+        self._loaded_continents = {}
+        self._loaded_countries = {}
+        self._loaded_regions = {}
+
+        # The one thread that all of the engine's database work runs on, whether
+        # it's driven by process_event or process_event_async.  Every connection is
+        # created and used only on it, which also keeps SQLite to a single writer
+        self._io_executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "p2app-engine")
+
+        # Maps each type of event the engine handles to a function that processes
+        # it, so process_event finds its handler with one lookup
+        self._handlers = {
+            # Application-level events
+            QuitInitiatedEvent: lambda event: self.quit(),
+
+            # Database-related events
+            OpenDatabaseEvent: lambda event: self.open_database(event.path()),
+            CloseDatabaseEvent: lambda event: self.close_database(),
+            BeginBulkEvent: lambda event: self.begin_bulk(),
+            EndBulkEvent: lambda event: self.end_bulk(),
+
+            # Continent-related events
+            StartContinentSearchEvent:
+                lambda event: self.search_continents(event.continent_code(), event.name()),
+            LoadContinentEvent: lambda event: self.load_continent(event.continent_id()),
+            SaveNewContinentEvent: lambda event: self.save_new_continent(event.continent()),
+            SaveContinentEvent: lambda event: self.save_continent(event.continent()),
+
+            # Country-related events
+            StartCountrySearchEvent:
+                lambda event: self.search_countries(event.country_code(), event.name()),
+            LoadCountryEvent: lambda event: self.load_country(event.country_id()),
+            SaveNewCountryEvent: lambda event: self.save_new_country(event.country()),
+            SaveCountryEvent: lambda event: self.save_country(event.country()),
+
+            # Region-related events
+            StartRegionSearchEvent:
+                lambda event: self.search_regions(
+                    event.region_code(), event.local_code(), event.name(), event.match_mode()),
+            LoadRegionEvent: lambda event: self.load_region(event.region_id()),
+            SaveNewRegionEvent: lambda event: self.save_new_region(event.region()),
+            SaveRegionEvent: lambda event: self.save_region(event.region()),
+            BulkSaveRegionsEvent: lambda event: self.bulk_save_regions(event.regions())
+        }
 
 
     def process_event(self, event):
         """A generator function that processes one event sent from the user interface,
-        yielding zero or more events in response."""
-
-        # Handle database-related events
-        if isinstance(event, OpenDatabaseEvent):
-            yield from self.open_database(event.path())
-        elif isinstance(event, CloseDatabaseEvent):
-            yield from self.close_database()
-
-        # Handle continent-related events
-        elif isinstance(event, StartContinentSearchEvent):
-            yield from self.search_continents(event.continent_code(), event.name())
-        elif isinstance(event, LoadContinentEvent):
-            yield from self.load_continent(event.continent_id())
-        elif isinstance(event, SaveNewContinentEvent):
-            yield from self.save_new_continent(event.continent())
-        elif isinstance(event, SaveContinentEvent):
-            yield from self.save_continent(event.continent())
-
-            # Handling country-related events
-        elif isinstance(event, StartCountrySearchEvent):
-            yield from self.search_countries(event.country_code(), event.name())
-        elif isinstance(event, LoadCountryEvent):
-            yield from self.load_country(event.country_id())
-        elif isinstance(event, SaveNewCountryEvent):
-            yield from self.save_new_country(event.country())
-        elif isinstance(event, SaveCountryEvent):
-            yield from self.save_country(event.country())
-
-        # Handle region-related events
-        elif isinstance(event, StartRegionSearchEvent):
-            yield from self.search_regions(event.region_code(), event.local_code(), event.name())
-        elif isinstance(event, LoadRegionEvent):
-            yield from self.load_region(event.region_id())
-        elif isinstance(event, SaveNewRegionEvent):
-            yield from self.save_new_region(event.region())
-        elif isinstance(event, SaveRegionEvent):
-            yield from self.save_region(event.region())
+        yielding zero or more events in response.  The database work runs on the
+        engine's I/O thread, while the caller waits for each event in turn"""
+        results = self._handle(event)
+
+        while True:
+            result = self._io_executor.submit(next, results, _NO_MORE_EVENTS).result()
+
+            if result is _NO_MORE_EVENTS:
+                break
+
+            yield result
+
+    async def process_event_async(self, event):
+        """An asynchronous generator that processes one event like process_event,
+        but awaits each event from the engine's I/O thread, so an event loop can
+        keep running while SQLite reads or commits"""
+        loop = asyncio.get_running_loop()
+        results = self._handle(event)
+
+        while True:
+            result = await loop.run_in_executor(self._io_executor, next, results, _NO_MORE_EVENTS)
+
+            if result is _NO_MORE_EVENTS:
+                break
+
+            yield result
+
+    def _handle(self, event):
+        """A generator function that runs the handler for one event, yielding the
+        events it responds with.  It's only advanced on the engine's I/O thread"""
+        handler = self._handlers.get(type(event))
+
+        if handler:
+            yield from handler(event)
 
     def open_database(self, path = None):
         """Opens the database at the specified path"""
         try:
+            if self.connection:
+                self._pool.release(self.db_path, self.connection, self._has_fts)
+                self.connection = None
+                self._in_bulk = False
+
             if path:
-                self.connection = sqlite3.connect(path)
+                self.db_path = path
+
+            self._clear_loaded()
+
+            pooled = self._pool.acquire(self.db_path)
+
+            if pooled:
+                self.connection, self._has_fts = pooled
             else:
-                self.connection = sqlite3.connect(self.db_path)
+                self.connection = sqlite3.connect(self.db_path, cached_statements = _CACHED_STATEMENTS)
+                self._configure_connection()
+
             yield DatabaseOpenedEvent(self.db_path)
         except sqlite3.Error as e:
+            # A connection that couldn't be configured isn't left open
+            if self.connection:
+                self.connection.close()
+                self.connection = None
+
+            self._has_fts = False
             yield DatabaseOpenFailedEvent(str(e))
 
+    def _configure_connection(self):
+        """Applies the engine's pragmas, row factory, search indexes and full-text
+        index to a newly opened connection"""
+        self.connection.row_factory = sqlite3.Row
+
+        # An in-memory database has no file to journal, so WAL doesn't apply to it.
+        # A read-only database can't switch journal modes, but is still usable in
+        # whatever mode it's already in.
+        if str(self.db_path) != _IN_MEMORY_PATH:
+            try:
+                self.connection.executescript(_WAL_PRAGMA)
+            except sqlite3.Error:
+                pass
+
+        self.connection.executescript(_CONNECTION_PRAGMAS)
+
+        # Indexes only make searches faster, so a database they can't be added to,
+        # such as a read-only one, is opened without them
+        self._run_setup_script(_SEARCH_INDEXES)
+        self._has_fts = self._set_up_full_text_index()
+
+    def _set_up_full_text_index(self):
+        """Creates the full-text index on region names and its triggers, returning
+        whether searches can use it.  Whether they can depends on the database as
+        well as the SQLite library, so if it can't be set up, its triggers are
+        dropped rather than left to break writes to region"""
+        if _is_fts_available():
+            setup = _REGION_FTS_SETUP
+
+            # Without its triggers, the index may have missed changes, so it's refilled
+            cursor = self.connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?", (_REGION_FTS_TRIGGER,))
+
+            if cursor.fetchone() is None:
+                setup += _REGION_FTS_REBUILD
+
+            if self._run_setup_script(setup):
+                return True
+
+        self._run_setup_script(_REGION_FTS_DROP_TRIGGERS)
+        return False
+
+    def _run_setup_script(self, script):
+        """Runs a script of schema changes in one transaction, returning whether it
+        succeeded.  If it fails, whatever it had changed is rolled back"""
+        try:
+            self.connection.executescript(f"BEGIN; {script} COMMIT;")
+            return True
+        except sqlite3.Error:
+            if self.connection.in_transaction:
+                self.connection.rollback()
+
+            return False
+
     def close_database(self):
-        """Closes the currently open database"""
+        """Closes the currently open database, returning its connection to the pool"""
         if self.connection:
-            self.connection.close()
+            self._pool.release(self.db_path, self.connection, self._has_fts)
             self.connection = None
+            self._in_bulk = False
+            self._has_fts = False
             yield DatabaseClosedEvent()
 
-    def search_continents(self, continent_code, name):
-        """Searches for continents matching the given criteria"""
+    def quit(self):
+        """Closes the open database and every pooled connection, then ends the
+        application"""
         if self.connection:
-            cursor = self.connection.cursor()
-            query = "SELECT * FROM continents WHERE 1=1"
-            params = []
+            self.connection.close()
+            self.connection = None
+            self._in_bulk = False
+
+        self._pool.close_all()
+        yield EndApplicationEvent()
+
+        # Shut down only once EndApplicationEvent has been taken, since taking it
+        # is itself work on the I/O thread
+        self._io_executor.shutdown(wait = False)
+
+    @contextmanager
+    def _transaction(self):
+        """A context manager around one save's statements.  Outside of a bulk
+        operation, they're committed when it exits, or rolled back if they raise;
+        during one, they join its transaction, which EndBulkEvent commits"""
+        if self._in_bulk:
+            yield
+        else:
+            with self.connection:
+                yield
+
+    def _save_returning(self, sql, params, from_row, loaded):
+        """Runs an INSERT or UPDATE that ends in a RETURNING clause as one save,
+        returning the model built from the row it returns, or None if it matched no
+        row.  The model is also remembered in loaded as the last version of its ID"""
+        with self._transaction():
+            row = self.connection.execute(sql, params).fetchone()
+
+        if row is None:
+            return None
+
+        model = from_row(row)
+        loaded[model[0]] = model
+        return model
+
+    def begin_bulk(self):
+        """Opens a transaction that subsequent saves join, so a series of them is
+        committed once instead of once each"""
+        if self.connection and not self._in_bulk:
+            try:
+                self.connection.execute("BEGIN IMMEDIATE")
+                self._in_bulk = True
+            except sqlite3.Error as e:
+                yield ErrorEvent(str(e))
+
+    def end_bulk(self):
+        """Commits the transaction opened by begin_bulk"""
+        if self.connection and self._in_bulk:
+            self._in_bulk = False
+
+            try:
+                self.connection.commit()
+            except sqlite3.Error as e:
+                self.connection.rollback()
 
-            if continent_code:
-                query += " AND continent_code = ?"
-                params.append(continent_code)
+                # What the bulk operation's saves remembered was never committed
+                self._clear_loaded()
+                yield ErrorEvent(str(e))
 
-            if name:
-                query += " AND name LIKE ?"
-                params.append(f"%{name}%")
+    def _clear_loaded(self):
+        """Forgets the last loaded version of every continent, country and region,
+        so the next save of each writes all of its columns"""
+        self._loaded_continents.clear()
+        self._loaded_countries.clear()
+        self._loaded_regions.clear()
 
-            cursor.execute(query, params)
-            results = cursor.fetchall()
+    def search_continents(self, continent_code, name):
+        """Searches for continents matching the given criteria"""
+        if self.connection:
+            mask = (bool(continent_code) << 1) | bool(name)
+            pattern = name and f"%{name}%"
+            params = ((continent_code,) if continent_code else ()) + ((pattern,) if pattern else ())
 
-            for row in results:
-                continent = Continent(row[0], row[1], row[2])
-                yield ContinentSearchResultEvent(continent)
+            cursor = self.connection.execute(_CONTINENT_QUERIES[mask], params)
+            yield from _search_results(cursor, _continent_from_row, ContinentSearchResultEvent)
 
     def load_continent(self, continent_id):
         """Loads a continent from the database by its ID"""
         if self.connection:
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT * FROM continents WHERE continent_id = ?", (continent_id,))
+            cursor = self.connection.execute(_LOAD_CONTINENT_SQL, (continent_id,))
             row = cursor.fetchone()
 
             if row:
-                continent = Continent(row[0], row[1], row[2])
+                continent = _continent_from_row(row)
+                self._loaded_continents[continent_id] = continent
                 yield ContinentLoadedEvent(continent)
             else:
                 yield ErrorEvent(f"Continent with ID {continent_id} not found")
@@ -123,14 +592,11 @@ class Engine:
         """Saves a new continent to the database"""
         if self.connection:
             try:
-                cursor = self.connection.cursor()
-                cursor.execute(
-                    "INSERT INTO continents (continent_code, name) VALUES (?, ?)",
-                    (continent.continent_code, continent.name)
-                )
-                self.connection.commit()
-                continent_id = cursor.lastrowid
-                saved_continent = Continent(continent_id, continent.continent_code, continent.name)
+                saved_continent = self._save_returning(
+                    _INSERT_CONTINENT_RETURNING_SQL,
+                    (continent.continent_code, continent.name),
+                    _continent_from_row, self._loaded_continents)
+
                 yield ContinentSavedEvent(saved_continent)
             except sqlite3.Error as e:
                 yield SaveContinentFailedEvent(str(e))
@@ -139,12 +605,20 @@ class Engine:
         """Saves an existing continent to the database"""
         if self.connection:
             try:
-                cursor = self.connection.cursor()
-                cursor.execute(
-                    "UPDATE continents SET continent_code = ?, name = ? WHERE continent_id = ?",
-                    (continent.continent_code, continent.name, continent.continent_id)
-                )
-                self.connection.commit()
+                changed = _changed_fields(self._loaded_continents.get(continent.continent_id), continent)
+
+                # When nothing differs from what was loaded, there's nothing to write
+                if changed:
+                    with self._transaction():
+                        cursor = self.connection.execute(
+                            _update_sql("continent", "continent_id", changed),
+                            tuple(getattr(continent, field) for field in changed) + (continent.continent_id,)
+                        )
+
+                    # An ID that matched no row leaves nothing in the database to remember
+                    if cursor.rowcount == 1:
+                        self._loaded_continents[continent.continent_id] = continent
+
                 yield ContinentSavedEvent(continent)
             except sqlite3.Error as e:
                 yield SaveContinentFailedEvent(str(e))
@@ -152,34 +626,22 @@ class Engine:
     def search_countries(self, country_code, name):
         """Searches for countries matching the given criteria"""
         if self.connection:
-            cursor = self.connection.cursor()
-            query = "SELECT * FROM country WHERE 1=1"
-            params = []
+            mask = (bool(country_code) << 1) | bool(name)
+            pattern = name and f"%{name}%"
+            params = ((country_code,) if country_code else ()) + ((pattern,) if pattern else ())
 
-            if country_code:
-                query += " AND country_code = ?"
-                params.append(country_code)
-
-            if name:
-                query += " AND name LIKE ?"
-                params.append(f"%{name}%")
-
-            cursor.execute(query, params)
-            results = cursor.fetchall()
-
-            for row in results:
-                country = Country(row[0], row[1], row[2], row[3], row[4], row[5])
-                yield CountrySearchResultEvent(country)
+            cursor = self.connection.execute(_COUNTRY_QUERIES[mask], params)
+            yield from _search_results(cursor, _country_from_row, CountrySearchResultEvent)
 
     def load_country(self, country_id):
         """Loads a country from the database by its ID"""
         if self.connection:
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT * FROM country WHERE country_id = ?", (country_id,))
+            cursor = self.connection.execute(_LOAD_COUNTRY_SQL, (country_id,))
             row = cursor.fetchone()
 
             if row:
-                country = Country(*row)
+                country = _country_from_row(row)
+                self._loaded_countries[country_id] = country
                 yield CountryLoadedEvent(country)
 
             else:
@@ -188,71 +650,75 @@ class Engine:
     def save_new_country(self, country):
         """Saves a new country into the database"""
         if self.connection:
-            cursor = self.connection.cursor()
-            cursor.execute(
-                "INSERT INTO country (country_code, name, continent_id, wikipedia_link, keywords) VALUES (?, ?, ?, ?, ?)",
-                (country.country_code, country.name, country.continent_id, country.wikipedia_link,
-                 country.keywords))
-            self.connection.commit()
-
-            # Calling  to get the ID of the country we just inserted
-            country_id = cursor.lastrowid
-
-            # Loading the continent we just inserted (to get any default values provided by the database)
-            yield from self.load_country(country_id)
+            try:
+                # The returned row includes the new ID and any default values provided by the database
+                saved_country = self._save_returning(
+                    _INSERT_COUNTRY_RETURNING_SQL,
+                    (country.country_code, country.name, country.continent_id, country.wikipedia_link,
+                     country.keywords),
+                    _country_from_row, self._loaded_countries)
+
+                yield CountryLoadedEvent(saved_country)
+            except sqlite3.Error as e:
+                yield SaveCountryFailedEvent(str(e))
 
     def save_country(self, country):
         """Saves the changes made to an existing country into the database"""
         if self.connection:
-            cursor = self.connection.cursor()
-            cursor.execute(
-                "UPDATE country SET country_code = ?, name = ?, continent_id = ?, wikipedia_link = ?, keywords = ? WHERE country_id = ?",
-                (country.country_code, country.name, country.continent_id, country.wikipedia_link,
-                 country.keywords, country.country_id))
-            self.connection.commit()
-
-            # Reloading the country we just saved to make sure we have the latest data
-            yield from self.load_country(country.country_id)
-
-    def search_regions(self, region_code, local_code, name):
-        """Searches for regions matching the given criteria"""
-        if self.connection:
-            cursor = self.connection.cursor()
-            query = "SELECT * FROM regions WHERE 1=1"
-            params = []
-
-            if region_code:
-                query += " AND region_code = ?"
-                params.append(region_code)
+            try:
+                previous = self._loaded_countries.get(country.country_id)
+                changed = _changed_fields(previous, country)
+
+                # When nothing differs from what was loaded, there's nothing to write
+                if changed:
+                    saved_country = self._save_returning(
+                        _update_sql("country", "country_id", changed, _COUNTRY_COLUMNS),
+                        tuple(getattr(country, field) for field in changed) + (country.country_id,),
+                        _country_from_row, self._loaded_countries)
+                else:
+                    saved_country = previous
 
-            if local_code:
-                query += " AND local_code = ?"
-                params.append(local_code)
+                if saved_country:
+                    yield CountryLoadedEvent(saved_country)
+                else:
+                    yield ErrorEvent(f"Country with ID {country.country_id} not found")
+            except sqlite3.Error as e:
+                yield SaveCountryFailedEvent(str(e))
 
-            if name:
-                query += " AND name LIKE ?"
-                params.append(f"%{name}%")
+    def search_regions(self, region_code, local_code, name, match_mode = "substring"):
+        """Searches for regions matching the given criteria.  In "prefix" mode, names
+        must start with the given name, which lets SQLite search the name index
+        instead of scanning every region"""
+        if self.connection:
+            mask = (bool(region_code) << 2) | (bool(local_code) << 1) | bool(name)
+            pattern = name and (f"{name}%" if match_mode == "prefix" else f"%{name}%")
+            params = (
+                ((region_code,) if region_code else ()) +
+                ((local_code,) if local_code else ()) +
+                ((pattern,) if pattern else ()))
+
+            # A substring search by name alone is answered by the full-text index
+            if mask == 0b001 and match_mode != "prefix" and self._has_fts and _is_fts_searchable(name):
+                query = _REGION_NAME_FTS_QUERY
+            else:
+                query = _REGION_QUERIES[mask]
 
             try:
-                cursor.execute(query, params)
-                results = cursor.fetchall()
-
-                for row in results:
-                    region = Region(row[0], row[1], row[2], row[3], row[4], row[5], row[6])
-                    yield RegionSearchResultEvent(region)
+                cursor = self.connection.execute(query, params)
+                yield from _search_results(cursor, _region_from_row, RegionSearchResultEvent)
             except sqlite3.Error as e:
                 yield ErrorEvent(str(e))
 
     def load_region(self, region_id):
         """Loads a region from the database by its ID"""
         if self.connection:
-            cursor = self.connection.cursor()
             try:
-                cursor.execute("SELECT * FROM regions WHERE region_id = ?", (region_id,))
+                cursor = self.connection.execute(_LOAD_REGION_SQL, (region_id,))
                 row = cursor.fetchone()
 
                 if row:
-                    region = Region(*row)
+                    region = _region_from_row(row)
+                    self._loaded_regions[region_id] = region
                     yield RegionLoadedEvent(region)
                 else:
                     yield ErrorEvent(f"Region with ID {region_id} not found")
@@ -263,19 +729,15 @@ class Engine:
         """Saves a new region into the database"""
         if self.connection:
             try:
-                cursor = self.connection.cursor()
-                cursor.execute(
-                    "INSERT INTO regions (region_code, local_code, name, continent_id, country_id, wikipedia_link, keywords) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                # The returned row includes the new ID and any default values
+                saved_region = self._save_returning(
+                    _INSERT_REGION_RETURNING_SQL,
                     (region.region_code, region.local_code, region.name, region.continent_id,
                      region.country_id,
-                     region.wikipedia_link, region.keywords))
-                self.connection.commit()
-
-                # Get the ID of the newly inserted region
-                region_id = cursor.lastrowid
+                     region.wikipedia_link, region.keywords),
+                    _region_from_row, self._loaded_regions)
 
-                # Load the newly inserted region to get any default values
-                yield from self.load_region(region_id)
+                yield RegionLoadedEvent(saved_region)
             except sqlite3.Error as e:
                 yield SaveRegionFailedEvent(str(e))
 
@@ -283,15 +745,36 @@ class Engine:
         """Saves the changes made to an existing region into the database"""
         if self.connection:
             try:
-                cursor = self.connection.cursor()
-                cursor.execute(
-                    "UPDATE regions SET region_code = ?, local_code = ?, name = ?, continent_id = ?, country_id = ?, wikipedia_link = ?, keywords = ? WHERE region_id = ?",
-                    (region.region_code, region.local_code, region.name, region.continent_id,
-                     region.country_id,
-                     region.wikipedia_link, region.keywords, region.region_id))
-                self.connection.commit()
+                previous = self._loaded_regions.get(region.region_id)
+                changed = _changed_fields(previous, region)
+
+                # When nothing differs from what was loaded, there's nothing to write
+                if changed:
+                    saved_region = self._save_returning(
+                        _update_sql("region", "region_id", changed, _REGION_COLUMNS),
+                        tuple(getattr(region, field) for field in changed) + (region.region_id,),
+                        _region_from_row, self._loaded_regions)
+                else:
+                    saved_region = previous
+
+                if saved_region:
+                    yield RegionLoadedEvent(saved_region)
+                else:
+                    yield ErrorEvent(f"Region with ID {region.region_id} not found")
+            except sqlite3.Error as e:
+                yield SaveRegionFailedEvent(str(e))
 
-                # Reloading the region we just saved to make sure we have the latest data
-                yield from self.load_region(region.region_id)
+    def bulk_save_regions(self, regions):
+        """Saves many new regions into the database in a single transaction"""
+        if self.connection:
+            try:
+                with self._transaction():
+                    cursor = self.connection.executemany(
+                        _INSERT_REGION_SQL,
+                        ((region.region_code, region.local_code, region.name, region.continent_id,
+                          region.country_id, region.wikipedia_link, region.keywords)
+                         for region in regions))
+
+                yield RegionsBulkSavedEvent(cursor.rowcount)
             except sqlite3.Error as e:
                 yield SaveRegionFailedEvent(str(e))
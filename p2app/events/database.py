@@ -33,6 +33,18 @@ class CloseDatabaseEvent:
 
 
 
+class BeginBulkEvent:
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}'
+
+
+
+class EndBulkEvent:
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}'
+
+
+
 class DatabaseOpenedEvent:
     def __init__(self, path: Path):
         self._path = path
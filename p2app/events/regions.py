@@ -33,10 +33,11 @@ Region.__annotations__ = {
 
 
 class StartRegionSearchEvent:
-    def __init__(self, region_code: str, local_code: str, name: str):
+    def __init__(self, region_code: str, local_code: str, name: str, match_mode: str = 'substring'):
         self._region_code = region_code
         self._local_code = local_code
         self._name = name
+        self._match_mode = match_mode
 
 
     def region_code(self) -> str:
@@ -51,9 +52,14 @@ class StartRegionSearchEvent:
         return self._name
 
 
+    def match_mode(self) -> str:
+        return self._match_mode
+
+
     def __repr__(self) -> str:
         return f'{type(self).__name__}: region_code = {repr(self._region_code)}, ' + \
-               f'local_name = {repr(self._local_code)}, name = {repr(self._name)}'
+               f'local_name = {repr(self._local_code)}, name = {repr(self._name)}, ' + \
+               f'match_mode = {repr(self._match_mode)}'
 
 
 
@@ -127,6 +133,20 @@ class SaveRegionEvent:
 
 
 
+class BulkSaveRegionsEvent:
+    def __init__(self, regions: list[Region]):
+        self._regions = regions
+
+
+    def regions(self) -> list[Region]:
+        return self._regions
+
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}: regions = {repr(self._regions)}'
+
+
+
 class RegionSavedEvent:
     def __init__(self, region: Region):
         self._region = region
@@ -141,6 +161,20 @@ class RegionSavedEvent:
 
 
 
+class RegionsBulkSavedEvent:
+    def __init__(self, count: int):
+        self._count = count
+
+
+    def count(self) -> int:
+        return self._count
+
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}: count = {repr(self._count)}'
+
+
+
 class SaveRegionFailedEvent:
     def __init__(self, reason: str):
         self._reason = reason
@@ -0,0 +1,122 @@
+# tests/test_engine.py
+#
+# Tests of the engine in p2app/engine/main.py, run against temporary databases
+# created from schema.sql.
+
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+from p2app.engine import Engine
+from p2app.events import *
+
+
+
+_SCHEMA_PATH = Path(__file__).parent.parent / 'schema.sql'
+
+
+
+class EngineTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = os.path.join(directory.name, 'test.db')
+
+        connection = sqlite3.connect(self.db_path)
+        connection.executescript(_SCHEMA_PATH.read_text())
+        connection.close()
+
+        self.engine = Engine()
+        self.addCleanup(lambda: list(self.engine.process_event(QuitInitiatedEvent())))
+
+
+    def process(self, event):
+        return list(self.engine.process_event(event))
+
+
+
+class RegionNameSearchTest(EngineTestCase):
+    def setUp(self):
+        super().setUp()
+
+        connection = sqlite3.connect(self.db_path)
+        connection.execute("INSERT INTO continent (continent_code, name) VALUES ('EU', 'Europe')")
+        connection.execute(
+            "INSERT INTO country (country_code, name, continent_id, wikipedia_link, keywords) "
+            "VALUES ('CH', 'Switzerland', 1, '', NULL)")
+        connection.executemany(
+            "INSERT INTO region (region_code, local_code, name, continent_id, country_id, "
+            "wikipedia_link, keywords) VALUES (?, ?, ?, 1, 1, NULL, NULL)",
+            [('CH-ZH', 'ZH', 'Zürich'), ('CH-XE', 'XE', 'xéa'), ('CH-RE', 'RE', 'Réunion'),
+             ('CH-BE', 'BE', 'Bern')])
+        connection.commit()
+        connection.close()
+
+        self.process(OpenDatabaseEvent(self.db_path))
+
+
+    def search(self, name):
+        events = self.process(StartRegionSearchEvent(None, None, name))
+        return sorted(event.region().name for event in events)
+
+
+    def plain_search(self, name):
+        connection = sqlite3.connect(self.db_path)
+        rows = connection.execute("SELECT name FROM region WHERE name LIKE ?", (f'%{name}%',))
+        names = sorted(row[0] for row in rows)
+        connection.close()
+        return names
+
+
+    def test_uses_full_text_index(self):
+        self.assertTrue(self.engine._has_fts)
+
+
+    def test_accented_names_match_plain_search(self):
+        for name in ('Zü', 'éa', 'Ré', 'ürich', 'Réun', 'xéa', 'ern', 'e', 'z%ch', 'R_u'):
+            with self.subTest(name = name):
+                self.assertEqual(self.search(name), self.plain_search(name))
+                self.assertNotEqual(self.search(name), [])
+
+
+
+class AsyncProcessingTest(EngineTestCase):
+    def process_async(self, event):
+        async def collect():
+            return [result async for result in self.engine.process_event_async(event)]
+
+        return asyncio.run(collect())
+
+
+    def test_async_use_after_sync_open(self):
+        self.process(OpenDatabaseEvent(self.db_path))
+        self.process(SaveNewContinentEvent(Continent(None, 'EU', 'Europe')))
+
+        continents = self.process_async(StartContinentSearchEvent(None, None))
+        regions = self.process_async(StartRegionSearchEvent(None, None, 'Zü'))
+
+        self.assertEqual(len(continents), 1)
+        self.assertEqual(continents[0].continent(), Continent(1, 'EU', 'Europe'))
+        self.assertEqual(regions, [])
+
+
+    def test_sync_use_after_async_open(self):
+        self.process_async(OpenDatabaseEvent(self.db_path))
+        saved = self.process(SaveNewContinentEvent(Continent(None, 'EU', 'Europe')))
+
+        self.assertEqual(saved[0].continent(), Continent(1, 'EU', 'Europe'))
+
+
+    def test_async_use_of_pooled_connection(self):
+        self.process(OpenDatabaseEvent(self.db_path))
+        self.process(CloseDatabaseEvent())
+        self.process_async(OpenDatabaseEvent(self.db_path))
+
+        self.assertEqual(self.process_async(StartContinentSearchEvent(None, None)), [])
+
+
+
+if __name__ == '__main__':
+    unittest.main()